@@ -1,22 +1,55 @@
 import os
 import io
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import sha256
+import numpy as np
 import google.generativeai as genai
-from flask import Flask, request, jsonify, render_template, Response
+import google.ai.generativelanguage as glm
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context, abort
 from dotenv import load_dotenv
-from PIL import Image, ImageOps # Added ImageOps for orientation
+from PIL import Image, features
 from werkzeug.utils import secure_filename # Good practice
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.parser import ParseFailedException
+from streaming_form_data.targets import BaseTarget
 
 # Load environment variables from .env file
 load_dotenv()
 
 app = Flask(__name__)
 
+# Reject oversized uploads with a 413 before Werkzeug receives the whole body;
+# images are shrunk to 800px anyway, so 8 MB is plenty
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_UPLOAD_MB", 8)) * 1024 * 1024
+
+# Catch decompression bombs while parsing the header, before pixels are allocated
+Image.MAX_IMAGE_PIXELS = 16_000_000
+
+# Keep freed pixel blocks in Pillow's allocator arena for reuse by the next
+# decode instead of returning them to malloc. Pillow caches none by default and
+# reads PILLOW_BLOCKS_MAX / PILLOW_BLOCK_SIZE itself, so only the default
+# changes here; retained memory is at most blocks_max x Image.core.get_block_size()
+if "PILLOW_BLOCKS_MAX" not in os.environ:
+    Image.core.set_blocks_max(4)
+
+# Report whether the JPEG codec is the SIMD-accelerated libjpeg-turbo build
+print(f"Pillow libjpeg-turbo support: {features.check_feature('libjpeg_turbo')}")
+
 # Configure the Gemini API client
 try:
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise ValueError("GEMINI_API_KEY not found in environment variables.")
-    genai.configure(api_key=api_key)
+    # REST transport: its HTTP calls cooperate with gevent workers (see
+    # gunicorn.conf.py), where the default gRPC channel would block the event
+    # loop. Connections are reused through one pooled requests session. The
+    # cost is that inline images are sent base64 in JSON (~33% more bytes).
+    genai.configure(api_key=api_key, transport='rest')
     # Using gemini-1.5-flash as it's generally faster and sufficient for this task
     model = genai.GenerativeModel('gemini-1.5-flash')
     print("Gemini API configured successfully.")
@@ -24,10 +57,397 @@ except Exception as e:
     print(f"Error configuring Gemini API: {e}")
     model = None # Set model to None if configuration fails
 
+# The prompt is the same for every request, so build its Part once
+PROMPT_PART = glm.Part(text="Identify the main items or objects visible in this image. Provide a list or a short description.")
+
+# Size of the keep-alive connection pool to the Gemini API; should cover the
+# number of requests a worker handles concurrently
+GEMINI_POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", 32))
+
+def _configure_connection_pool(pool_size):
+    """Widens the SDK's shared HTTP session pool so concurrent calls don't drop connections."""
+    from google.generativeai import client as genai_client
+    from requests.adapters import HTTPAdapter
+
+    # The default generative client is a singleton that every GenerativeModel
+    # picks up on its first call, so tuning its session here covers `model`
+    gemini_client = genai_client.get_default_generative_client()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    gemini_client._transport._session.mount('https://', adapter)
+    print(f"Gemini HTTP pool ready (client id {id(gemini_client)}, size {pool_size}).")
+
+if model is not None:
+    try:
+        _configure_connection_pool(GEMINI_POOL_SIZE)
+    except Exception as e:
+        # Not fatal: the SDK still reuses its default (smaller) pool
+        print(f"Could not configure Gemini connection pool: {e}")
+
+# Cache of Gemini descriptions keyed by the SHA-256 of the uploaded image bytes,
+# so re-submitting the same photo skips the API round-trip entirely
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 1024))
+_RESULT_CACHE = OrderedDict()
+_RESULT_CACHE_LOCK = threading.Lock() # Flask's server handles requests in threads
+
+def _cache_get(key):
+    """Returns the cached description for key (marking it recently used), or None."""
+    with _RESULT_CACHE_LOCK:
+        if key not in _RESULT_CACHE:
+            return None
+        _RESULT_CACHE.move_to_end(key)
+        return _RESULT_CACHE[key]
+
+def _cache_put(key, description):
+    """Stores a description, evicting the least recently used entry when full."""
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE[key] = description
+        _RESULT_CACHE.move_to_end(key)
+        while len(_RESULT_CACHE) > RESULT_CACHE_SIZE:
+            _RESULT_CACHE.popitem(last=False)
+
+# Read size for the raw request body
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Define max dimensions (adjust as needed)
+# Lowering slightly further for potentially more constrained environments
+MAX_IMAGE_SIZE = (800, 800)
+
+# EXIF orientation value -> transpose that makes the image upright
+# (same mapping as ImageOps.exif_transpose, minus its EXIF rewrite)
+EXIF_ORIENTATION_TAG = 0x0112
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# Maximum /analyze requests per worker that are buffering their upload or
+# decoding it at once (Gemini calls are not limited); size it as roughly
+# available RAM / (MAX_UPLOAD_MB + peak decode memory, ~50 MB for a 12MP photo)
+_INFLIGHT = threading.BoundedSemaphore(int(os.getenv("MAX_INFLIGHT", 4)))
+
+class _InflightSlot:
+    """An acquired _INFLIGHT slot that can be released early; later releases are no-ops."""
+
+    def __init__(self):
+        self._held = True
+
+    def release(self):
+        if self._held:
+            self._held = False
+            _INFLIGHT.release()
+
+# Optional direct libjpeg-turbo encoder; falls back to Pillow when the
+# package or the libturbojpeg shared library is missing
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJPF_RGBX, TJSAMP_420
+    _TJ = TurboJPEG()
+    _TJ_PIXEL_FORMATS = {'RGB': TJPF_RGB, 'RGBA': TJPF_RGBX, 'RGBX': TJPF_RGBX}
+    print("TurboJPEG encoder available.")
+except Exception as e:
+    print(f"TurboJPEG unavailable, encoding with Pillow: {e}")
+    _TJ = None
+
+# Optional local classifier (e.g. an int8 MobileNetV3 ONNX model) that answers
+# common, unambiguous uploads itself instead of calling Gemini. Enabled by
+# pointing LOCAL_CLASSIFIER_PATH at the model and LOCAL_CLASSIFIER_LABELS at a
+# text file with one class name per line. The model takes a single
+# 1x3x224x224 ImageNet-normalised input; set LOCAL_CLASSIFIER_OUTPUTS to
+# "logits" (default) or "probs" to match what its first output contains.
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", 0.85))
+LOCAL_CLASSIFIER_OUTPUTS = os.getenv("LOCAL_CLASSIFIER_OUTPUTS", "logits").lower()
+# Only these labels may skip Gemini (comma-separated); required to enable the classifier
+LOCAL_CLASSIFIER_WHITELIST = {label.strip() for label in os.getenv("LOCAL_CLASSIFIER_WHITELIST", "").split(",") if label.strip()}
+_IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+_IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+_CLASSIFIER = None
+if os.getenv("LOCAL_CLASSIFIER_PATH") and not LOCAL_CLASSIFIER_WHITELIST:
+    print("LOCAL_CLASSIFIER_WHITELIST is empty, local classifier disabled; using Gemini only.")
+elif os.getenv("LOCAL_CLASSIFIER_PATH"):
+    try:
+        if LOCAL_CLASSIFIER_OUTPUTS not in ('logits', 'probs'):
+            raise ValueError(f"LOCAL_CLASSIFIER_OUTPUTS must be 'logits' or 'probs', not {LOCAL_CLASSIFIER_OUTPUTS!r}.")
+        import onnxruntime as ort
+        _CLASSIFIER = ort.InferenceSession(os.getenv("LOCAL_CLASSIFIER_PATH"), providers=['CPUExecutionProvider'])
+        with open(os.getenv("LOCAL_CLASSIFIER_LABELS", "")) as labels_file:
+            _CLASSIFIER_LABELS = [line.strip() for line in labels_file]
+        # Symbolic (dynamic) dimensions can't be checked here; _classify_locally re-checks
+        num_classes = _CLASSIFIER.get_outputs()[0].shape[-1]
+        if isinstance(num_classes, int) and num_classes != len(_CLASSIFIER_LABELS):
+            raise ValueError(f"model has {num_classes} outputs but the labels file has {len(_CLASSIFIER_LABELS)} lines.")
+        print(f"Local classifier loaded ({len(_CLASSIFIER_LABELS)} labels).")
+    except Exception as e:
+        print(f"Error loading local classifier, using Gemini only: {e}")
+        _CLASSIFIER = None
+
+def _make_preprocess_pool(max_workers):
+    """Returns an executor backed by real OS threads, even under gevent workers."""
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            # Patched threads are greenlets, which would run Pillow on the event
+            # loop; gevent's pool uses native threads and waits cooperatively
+            from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+            return GeventThreadPoolExecutor(max_workers=max_workers)
+    except ImportError:
+        pass
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+# Worker threads for CPU-bound image preprocessing
+_POOL = _make_preprocess_pool(max(2, os.cpu_count() or 1))
+
+class _ImageUpload(BaseTarget):
+    """Multipart target that buffers the image part in memory and hashes it as it streams in."""
+
+    def __init__(self):
+        super().__init__()
+        self.buffer = io.BytesIO()
+        self.digest = sha256()
+        self.size = 0
+        self.started = False
+
+    def on_start(self):
+        self.started = True
+
+    def on_data_received(self, chunk):
+        self.buffer.write(chunk)
+        self.digest.update(chunk)
+        self.size += len(chunk)
+
+# Modes Image.reduce() supports; others (P, 1, I;16, ...) raise ValueError
+_REDUCE_MODES = {'L', 'LA', 'RGB', 'RGBA', 'RGBX', 'CMYK', 'I', 'F'}
+
+def _integer_shrink_factor(size, max_size):
+    """Returns k >= 2 if shrinking size by exactly k fits it to max_size, else None."""
+    (width, height), (max_width, max_height) = size, max_size
+    ratio = max(width / max_width, height / max_height)
+    factor = int(ratio)
+    if factor >= 2 and factor == ratio and width % factor == 0 and height % factor == 0:
+        return factor
+    return None
+
+def _classify_locally(img):
+    """Returns a short description if the local classifier is confident enough, else None."""
+    rgb = img.convert('RGB').resize((224, 224), Image.Resampling.BILINEAR)
+    pixels = (np.asarray(rgb, dtype=np.float32) / 255.0 - _IMAGENET_MEAN) / _IMAGENET_STD
+    batch = pixels.transpose(2, 0, 1)[np.newaxis] # HWC -> NCHW
+    scores = np.asarray(_CLASSIFIER.run(None, {_CLASSIFIER.get_inputs()[0].name: batch})[0]).reshape(-1)
+    if scores.size != len(_CLASSIFIER_LABELS):
+        raise ValueError(f"classifier returned {scores.size} scores for {len(_CLASSIFIER_LABELS)} labels.")
+
+    if LOCAL_CLASSIFIER_OUTPUTS == 'probs':
+        probs = scores
+    else:
+        probs = np.exp(scores - scores.max())
+        probs /= probs.sum()
+    best = int(probs.argmax())
+    label = _CLASSIFIER_LABELS[best]
+    if probs[best] < LOCAL_CLASSIFIER_THRESHOLD:
+        return None
+    if label not in LOCAL_CLASSIFIER_WHITELIST:
+        return None
+    return f"A {label}."
+
+def _preprocess(stream, max_size=MAX_IMAGE_SIZE):
+    """Decodes, orients and shrinks an uploaded image.
+
+    Returns (JPEG bytes, local description or None); a local description
+    means the classifier already answered and Gemini can be skipped.
+    """
+    img = Image.open(stream)
+
+    # Let libjpeg downscale during decode (1/2, 1/4, 1/8) so big phone JPEGs
+    # are never fully decoded; no-op for other formats. Must run before
+    # anything loads the pixels, so it goes ahead of exif_transpose.
+    img.draft('RGB', max_size)
+
+    # Fix orientation based on EXIF data (important for phone photos). Most
+    # photos are already upright (orientation 1), which needs no copy at all
+    orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    if orientation in _ORIENTATION_TRANSPOSE:
+        img = img.transpose(_ORIENTATION_TRANSPOSE[orientation])
+
+    # draft() (JPEG) or thumbnail's own reducing_gap pre-shrink leaves the final
+    # step within ~2x of the target, where a 2-tap bilinear filter looks the
+    # same to Gemini as LANCZOS at a fraction of the cost
+    factor = _integer_shrink_factor(img.size, max_size)
+    if factor and img.mode in _REDUCE_MODES:
+        # Exact integer ratio: a plain box average (Image.reduce, vectorized C)
+        # lands on the target size with no resampling kernel at all. Mostly
+        # hits non-JPEG uploads; after draft() real phone photos rarely divide
+        # evenly (4032x3024 -> 2016x1512 is a 2.52 ratio) and use thumbnail
+        img = img.reduce(factor)
+    else:
+        img.thumbnail(max_size, Image.Resampling.BILINEAR)
+
+    if _CLASSIFIER is not None:
+        try:
+            local_description = _classify_locally(img)
+        except Exception as e:
+            # The classifier is only a shortcut; fall back to Gemini
+            print(f"Local classifier failed, using Gemini: {e}")
+            local_description = None
+        if local_description is not None:
+            return None, local_description
+
+    # Re-encode as JPEG q80 ourselves: handing the SDK a PIL object makes it
+    # upload a lossless PNG, several times more bytes on the wire
+    return _encode_jpeg(img), None
+
+def _encode_jpeg(img, quality=80):
+    """Encodes a PIL image as JPEG bytes, via TurboJPEG when it is available."""
+    if _TJ is not None and img.mode in _TJ_PIXEL_FORMATS:
+        # libjpeg-turbo reads RGB/RGBX pixels directly, skipping Pillow's
+        # RGBA -> RGB conversion pass
+        return _TJ.encode(np.asarray(img), quality=quality,
+                          pixel_format=_TJ_PIXEL_FORMATS[img.mode], jpeg_subsample=TJSAMP_420)
+    output_buffer = io.BytesIO()
+    img.convert('RGB').save(output_buffer, format='JPEG', quality=quality, optimize=False, progressive=False)
+    return output_buffer.getvalue()
+
+# Optional micro-batching: with GEMINI_BATCH_SIZE > 1, images that arrive
+# within GEMINI_BATCH_WINDOW_MS of each other share a single Gemini call.
+# Batched answers are not streamed.
+GEMINI_BATCH_SIZE = int(os.getenv("GEMINI_BATCH_SIZE", 1))
+GEMINI_BATCH_WINDOW_MS = int(os.getenv("GEMINI_BATCH_WINDOW_MS", 20))
+BATCH_PROMPT_PART = glm.Part(text=(
+    "Each of the following images is preceded by its index. For each image, identify the main "
+    "items or objects visible in it and provide a list or a short description. Respond with a "
+    "JSON object mapping each index (as a string) to that image's description."
+))
+
+class _MicroBatcher:
+    """Collects concurrent image submissions and sends them to Gemini together."""
+
+    def __init__(self, max_size, window_seconds):
+        self._max_size = max_size
+        self._window_seconds = window_seconds
+        self._queue = queue.Queue()
+        threading.Thread(target=self._collect, daemon=True).start()
+
+    def describe(self, image_part):
+        """Blocks until the batch containing image_part is answered; returns its description."""
+        future = Future()
+        self._queue.put((image_part, future))
+        return future.result()
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._window_seconds
+            while len(batch) < self._max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Call Gemini off the collector thread so the next batch can form meanwhile
+            threading.Thread(target=self._dispatch, args=(batch,), daemon=True).start()
+
+    def _dispatch(self, batch):
+        descriptions = [None] * len(batch)
+        if len(batch) > 1:
+            try:
+                descriptions = self._describe_batch([image_part for image_part, _ in batch])
+                print(f"Gemini batch of {len(batch)} images answered.")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                return
+        # Images the batch answer left out (or a batch of one) get their own call
+        for (image_part, future), description in zip(batch, descriptions):
+            if description is None:
+                try:
+                    description = model.generate_content([PROMPT_PART, image_part]).text
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+            future.set_result(description)
+
+    def _describe_batch(self, image_parts):
+        """Asks Gemini about several images in one call; returns one description (or None) per image."""
+        contents = [BATCH_PROMPT_PART]
+        for index, image_part in enumerate(image_parts):
+            contents += [glm.Part(text=f"Image {index}:"), image_part]
+        # Constrain the answer to {"0": "...", "1": "...", ...} with string values
+        keys = [str(index) for index in range(len(image_parts))]
+        schema = glm.Schema(
+            type_=glm.Type.OBJECT,
+            properties={key: glm.Schema(type_=glm.Type.STRING) for key in keys},
+            required=keys,
+        )
+        response = model.generate_content(contents, generation_config={
+            "response_mime_type": "application/json", "response_schema": schema})
+        answers = json.loads(response.text)
+        if not isinstance(answers, dict):
+            print("Gemini batch response is not a JSON object, falling back to single-image calls.")
+            return [None] * len(image_parts)
+        return [_batch_description(answers.get(key)) for key in keys]
+
+def _batch_description(value):
+    """Normalises one batched answer to text; lists become one item per line, anything else None."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return "\n".join(value)
+    return None
+
+_BATCHER = None
+if model is not None and GEMINI_BATCH_SIZE > 1:
+    _BATCHER = _MicroBatcher(GEMINI_BATCH_SIZE, GEMINI_BATCH_WINDOW_MS / 1000)
+
+def _ndjson_line(**fields):
+    """Encodes one newline-delimited JSON record."""
+    return json.dumps(fields) + "\n"
+
+def _ndjson_response(lines):
+    """Streams an iterable of NDJSON lines to the client as they are produced."""
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+def _stream_description(response, cache_key):
+    """Yields Gemini's streamed answer as {"delta": ...} lines and caches the full text."""
+    detected_items = []
+    try:
+        for chunk in response:
+            detected_items.append(chunk.text)
+            yield _ndjson_line(delta=chunk.text)
+    except genai.types.generation_types.StopCandidateException as e:
+        # Headers are already sent, so errors mid-stream are reported in-band
+        print(f"Gemini generation stopped unexpectedly: {e}")
+        yield _ndjson_line(error="Analysis failed or content flagged by API.")
+        return
+    except Exception as e:
+        print(f"Error streaming Gemini response: {e}")
+        import traceback
+        traceback.print_exc()
+        yield _ndjson_line(error="An internal error occurred during analysis.")
+        return
+    _cache_put(cache_key, "".join(detected_items))
+
+# The landing page is static, so render it once instead of on every request
+with app.app_context():
+    _INDEX_HTML = render_template('index.html').encode('utf-8')
+_INDEX_ETAG = sha256(_INDEX_HTML).hexdigest()[:32]
+
 @app.route('/')
 def index():
     """Serves the main HTML page."""
-    return render_template('index.html')
+    response = Response(_INDEX_HTML, mimetype='text/html')
+    response.set_etag(_INDEX_ETAG)
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    # Answers 304 Not Modified when the browser's If-None-Match matches
+    return response.make_conditional(request)
+
+@app.errorhandler(413)
+def file_too_large(e):
+    """Returns a JSON error when an upload exceeds MAX_CONTENT_LENGTH."""
+    return jsonify({"error": "File too large. Please use a smaller image."}), 413
 
 @app.route('/analyze', methods=['POST'])
 def analyze_image():
@@ -35,58 +455,86 @@ def analyze_image():
     if model is None:
          return jsonify({"error": "Gemini API not configured. Check server logs."}), 500
 
-    if 'image' not in request.files:
+    if request.mimetype != 'multipart/form-data':
+        return jsonify({"error": "No image file provided"}), 400
+    # request.stream below bypasses Werkzeug's form parser, and with it the
+    # MAX_CONTENT_LENGTH check on older Werkzeug versions
+    if (request.content_length or 0) > app.config['MAX_CONTENT_LENGTH']:
+        abort(413)
+
+    # Shed load at the door instead of letting a burst of uploads and decodes
+    # exhaust memory; the slot covers buffering the body and decoding it, and
+    # is released before Gemini is called
+    if not _INFLIGHT.acquire(blocking=False):
+        return jsonify({"error": "Server busy. Please try again shortly."}), 503, {"Retry-After": "1"}
+    slot = _InflightSlot()
+    try:
+        return _analyze_upload(slot)
+    finally:
+        slot.release()
+
+def _analyze_upload(slot):
+    """Parses, preprocesses and submits the upload; releases slot once the image is decoded."""
+    # Parse the multipart body ourselves as it arrives, hashing the image on
+    # the fly instead of spooling it to a temporary file first
+    upload = _ImageUpload()
+    try:
+        # Raises ParseFailedException too, e.g. for a Content-Type without a boundary
+        parser = StreamingFormDataParser(headers=request.headers)
+        parser.register('image', upload)
+        for chunk in iter(lambda: request.stream.read(UPLOAD_CHUNK_SIZE), b''):
+            parser.data_received(chunk)
+    except ParseFailedException as e:
+        print(f"Malformed upload: {e}")
+        return jsonify({"error": "Invalid file uploaded"}), 400
+
+    if not upload.started:
         return jsonify({"error": "No image file provided"}), 400
 
-    file = request.files['image']
-    filename = secure_filename(file.filename) # Sanitize filename
+    filename = secure_filename(upload.multipart_filename or '') # Sanitize filename
 
     if filename == '':
         return jsonify({"error": "No image selected"}), 400
 
-    if file:
+    if upload.size:
         try:
-            # Read image bytes directly from the file stream
-            img_bytes = file.read()
-            img_size_kb = len(img_bytes) / 1024
+            cache_key = upload.digest.hexdigest()
+            img_size_kb = upload.size / 1024
             print(f"Original image size: {img_size_kb:.2f} KB")
 
-            # --- Image Resizing & Orientation Fix ---
-            img = Image.open(io.BytesIO(img_bytes))
-
-            # Fix orientation based on EXIF data (important for phone photos)
-            img = ImageOps.exif_transpose(img)
-
-            # Define max dimensions (adjust as needed)
-            # Lowering slightly further for potentially more constrained environments
-            max_size = (800, 800)
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)
+            # Identical uploads get the cached answer without calling Gemini
+            cached = _cache_get(cache_key)
+            if cached is not None:
+                print("Cache hit, skipping Gemini call.")
+                return _ndjson_response(iter([_ndjson_line(delta=cached)]))
 
-            # Gemini SDK can often handle the PIL Image object directly after processing
-            processed_img = img # Use the resized PIL object
-
-            # If passing the PIL object fails later, you might need to save to bytes
-            # and construct the Part manually (less common now):
-            # output_buffer = io.BytesIO()
-            # img_format = img.format if img.format in ['JPEG', 'PNG', 'WEBP'] else 'JPEG'
-            # img.save(output_buffer, format=img_format, quality=80) # Slightly lower quality ok
-            # resized_img_bytes = output_buffer.getvalue()
-            # resized_img_size_kb = len(resized_img_bytes) / 1024
-            # print(f"Resized image size: {resized_img_size_kb:.2f} KB")
-            # import google.ai.generativelanguage as glm
-            # processed_img = glm.Part(inline_data=glm.Blob(mime_type=f'image/{img_format.lower()}', data=resized_img_bytes))
-            # ---- End of alternative byte method ----
+            # --- Image Resizing & Orientation Fix ---
+            # Runs on the shared pool; Pillow releases the GIL while decoding,
+            # resizing and encoding, so several uploads are processed in parallel
+            upload.buffer.seek(0)
+            resized_img_bytes, local_description = _POOL.submit(_preprocess, upload.buffer).result()
+            # The raw upload and decoded pixels are no longer needed
+            upload.buffer = None
+            slot.release()
 
-            # Prepare the prompt for Gemini
-            prompt = "Identify the main items or objects visible in this image. Provide a list or a short description."
+            if local_description is not None:
+                print(f"Local classifier answered: {local_description}")
+                _cache_put(cache_key, local_description)
+                return _ndjson_response(iter([_ndjson_line(delta=local_description)]))
 
-            # Send the processed (resized) image and prompt to Gemini
-            response = model.generate_content([prompt, processed_img])
+            resized_img_size_kb = len(resized_img_bytes) / 1024
+            print(f"Resized image size: {resized_img_size_kb:.2f} KB")
+            processed_img = glm.Part(inline_data=glm.Blob(mime_type='image/jpeg', data=resized_img_bytes))
 
-            # Extract the text response
-            detected_items = response.text
+            if _BATCHER is not None:
+                detected_items = _BATCHER.describe(processed_img)
+                _cache_put(cache_key, detected_items)
+                return _ndjson_response(iter([_ndjson_line(delta=detected_items)]))
 
-            return jsonify({"description": detected_items})
+            # Send the processed (resized) image and prompt to Gemini, streaming the
+            # answer back so the client sees the first words without waiting for all
+            response = model.generate_content([PROMPT_PART, processed_img], stream=True)
+            return _ndjson_response(_stream_description(response, cache_key))
 
         except Image.DecompressionBombError:
             print("Error: Image is too large or could be a decompression bomb.")
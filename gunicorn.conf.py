@@ -0,0 +1,16 @@
+# Gunicorn settings, picked up automatically from the working directory
+import os
+
+# Most of each /analyze request is spent waiting on the Gemini API, so each
+# worker runs many threads to keep dozens of calls in flight at once.
+# Keep GEMINI_POOL_SIZE in app.py at least as large as `threads`.
+#
+# Set GUNICORN_WORKER_CLASS=gevent to serve uploads and Gemini calls from
+# greenlets instead; the gevent worker monkey-patches the standard library
+# before app.py is imported, and image preprocessing still runs on native
+# threads (see _make_preprocess_pool). Don't combine it with --preload.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+threads = int(os.getenv("GUNICORN_THREADS", 32))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 100))
+bind = f"0.0.0.0:{os.getenv('PORT', 8080)}"